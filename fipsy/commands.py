@@ -1,18 +1,46 @@
 """Click subcommands for fipsy CLI."""
 
+import atexit
+import hashlib
 import json
+import re
 import shutil
-import subprocess
-import tempfile
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
 
 import click
-from tqdm import tqdm
 
 from fipsy import db, ipfs
 
 DISCOVERY_DIR_NAME = ".ipns-index"
+IO_POOL_SIZE = 32
+# Peer indexes are a small JSON map; anything larger is truncated and rejected
+MAX_INDEX_SIZE = 1024 * 1024
+# Seconds to skip a peer after its index could not be fetched
+FAILED_PEER_TTL = 600
+# An unchanged discovery index is republished at most this often (seconds)
+INDEX_REPUBLISH_INTERVAL = 60 * 60
+# Resolve timeout for pin checks, shorter than a scan's: a dead name only
+# costs its pin marker
+PIN_CHECK_TIMEOUT = 5
+# CIDv1 of dag-pb/raw content in base32. "Qm..." is left out: legacy RSA peer
+# IDs, and so their IPNS names, look exactly like CIDv0.
+_CID_RE = re.compile(r"baf[ky][a-z2-7]{55,}")
+
+# Shared by all concurrent IPFS calls, so threads stay warm between batches
+_IO_POOL = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="fipsy-io")
+atexit.register(_IO_POOL.shutdown, wait=False)
 
 
 def ensure_ipfs() -> None:
@@ -29,7 +57,7 @@ def _pin_cid(cid: str) -> bool:
     try:
         ipfs.pin_add(cid)
         return True
-    except subprocess.CalledProcessError:
+    except ipfs.IpfsError:
         return False
 
 
@@ -50,120 +78,212 @@ def scan(pin: bool) -> None:
         click.echo("No peers found.")
         return
 
-    click.echo(f"Found {len(peers)} peer(s). Scanning for published indexes...\n")
+    # Don't wait out the cat timeout again for peers that just had no index
+    failed = db.get_failed_peers(FAILED_PEER_TTL)
+    to_scan = [pid for pid in peers if pid not in failed]
+    skipped = len(peers) - len(to_scan)
+    skipped_note = f" ({skipped} without an index skipped)" if skipped else ""
+    click.echo(
+        f"Found {len(peers)} peer(s){skipped_note}. Scanning for published indexes...\n"
+    )
 
-    results = _fetch_peer_indexes(peers)
+    results = _fetch_peer_indexes(to_scan)
     if not results:
         click.echo("No published indexes found.")
         return
 
+    discovered: list[tuple[str, str, str | None]] = []
     for peer_id, ipns_keys in results:
         click.echo(f"Peer Index: ipns://{peer_id}")
-        db.upsert_discovered(peer_id, peer_id)  # index: key=node_id, name=NULL
+        discovered.append((peer_id, peer_id, None))  # index: key=node_id, name=NULL
         for name, (ipns_name, resolved) in ipns_keys.items():
             if resolved:
-                cid = resolved.split("/")[-1]
-                click.echo(f"  {name} (IPNS): ipns://{ipns_name}")
+                cid = resolved.rpartition("/")[2]
+                if not _immutable_path(ipns_name):
+                    click.echo(f"  {name} (IPNS): ipns://{ipns_name}")
                 click.echo(f"  {name} (IPFS): ipfs://{cid}")
                 if pin:
                     if _pin_cid(cid):
                         click.echo(f"  {name}: pinned")
                     else:
                         click.echo(f"  {name}: pin failed")
-                db.upsert_discovered(peer_id, ipns_name, name=name)
             else:
                 click.echo(f"  {name}: unresolved... (ipns://{ipns_name})")
-                db.upsert_discovered(peer_id, ipns_name, name=name)
+            discovered.append((peer_id, ipns_name, name))
         click.echo()
 
+    db.upsert_discovered_many(discovered)
+
+
+def _immutable_path(name: str) -> str | None:
+    """Return `/ipfs/<cid>` if an index entry names a CID instead of a key."""
+    cid = name.removeprefix("/ipfs/")
+    return f"/ipfs/{cid}" if _CID_RE.fullmatch(cid) else None
+
+
+def _resolve_key(
+    ipns_name: str, timeout: float = ipfs.DEFAULT_RESOLVE_TIMEOUT
+) -> str | None:
+    """Resolve an IPNS name to its CID. Returns None on failure.
 
-def _resolve_key(ipns_name: str) -> str | None:
-    """Resolve an IPNS name to its CID. Returns None on failure."""
+    Results are cached in the DB for the record TTL, so repeat scans skip the
+    (slow) IPNS lookup. A CID, bare or as `/ipfs/<cid>`, is returned as a path.
+    """
+    immutable = _immutable_path(ipns_name)
+    if immutable:
+        return immutable
+    cached = db.get_resolved(ipns_name)
+    if cached:
+        return cached
     try:
-        return ipfs.name_resolve(ipns_name)
-    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        resolved = ipfs.name_resolve(ipns_name, timeout=timeout)
+    except ipfs.IpfsError:
         return None
+    db.put_resolved(ipns_name, resolved)
+    return resolved
+
+
+def _publish_cid(cid: str, key: str | None = None) -> str:
+    """Publish a CID under an IPNS key (default: self). Returns the IPNS name.
+
+    The new path is written through to the resolve cache, so this node never
+    serves its own stale record from it.
+    """
+    ipns_name = ipfs.name_publish(cid, key=key, ttl="1m")
+    db.put_resolved(ipns_name, f"/ipfs/{cid}")
+    return ipns_name
 
 
 def _fetch_peer_index(
     peer_id: str,
     cat_timeout: float = ipfs.DEFAULT_CAT_TIMEOUT,
-) -> tuple[str, dict[str, tuple[str, str | None]]] | None:
-    """Fetch a single peer's index.json and resolve IPNS keys.
+) -> dict[str, str] | None:
+    """Fetch a single peer's index.json.
 
-    Returns (peer_id, {name: (key_id, resolved_path_or_none)}) or None.
+    Returns {name: key_id} of the peer's published IPNS keys, or None.
     """
+    # Check for the peer's IPNS record first: peers that never published one
+    # bail out here, and repeat scans get the index CID from the resolve cache.
+    # The resolve and the cat share one cat_timeout budget.
+    deadline = time.monotonic() + cat_timeout
+    index_path = _resolve_key(peer_id, timeout=cat_timeout)
+    remaining = deadline - time.monotonic()
+    if index_path is None or remaining <= 0:
+        return None
     try:
-        raw = ipfs.cat_path(f"/ipns/{peer_id}/index.json", timeout=cat_timeout)
+        raw = ipfs.cat_path(
+            f"{index_path}/index.json", timeout=remaining, length=MAX_INDEX_SIZE
+        )
+        # Parses the bytes directly; a bad encoding raises UnicodeDecodeError,
+        # which like JSONDecodeError is a ValueError
         data = json.loads(raw)
-    except (
-        subprocess.CalledProcessError,
-        subprocess.TimeoutExpired,
-        json.JSONDecodeError,
-        OSError,
-    ):
+    except (ipfs.IpfsError, ValueError):
         return None
 
-    ipns_keys: dict[str, str] = data.get("ipns", {})
-    if not ipns_keys:
+    # Indexes come from arbitrary peers: keep only well-formed entries
+    ipns = data.get("ipns") if isinstance(data, dict) else None
+    if not isinstance(ipns, dict):
         return None
-
-    # Resolve all IPNS keys concurrently
-    MAX_WORKERS = 10
-    resolved: dict[str, tuple[str, str | None]] = {}
-    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(ipns_keys))) as pool:
-        futures = {
-            pool.submit(_resolve_key, key_id): name
-            for name, key_id in ipns_keys.items()
-        }
-        for future in as_completed(futures):
-            name = futures[future]
-            resolved[name] = (ipns_keys[name], future.result())
-
-    return (peer_id, resolved)
+    ipns_keys = {
+        name: key_id
+        for name, key_id in ipns.items()
+        if isinstance(name, str) and isinstance(key_id, str)
+    }
+    return ipns_keys or None
 
 
 MANY_PEERS_THRESHOLD = 20
 FAST_CAT_TIMEOUT = 2.69
+MAX_WORKERS = 20
+INITIAL_FETCH_WINDOW = 4
+FETCH_WINDOW_GROW_INTERVAL = 0.5
 
 
 def _fetch_peer_indexes(
     peers: list[str],
 ) -> list[tuple[str, dict[str, tuple[str, str | None]]]]:
-    """Fetch indexes from all peers concurrently."""
-    MAX_WORKERS = 20
+    """Fetch indexes from all peers and resolve their IPNS keys concurrently.
+
+    Index fetches and key resolves share a single pool: each peer's keys are
+    queued for resolution as soon as its index arrives. The number of index
+    fetches in flight starts at INITIAL_FETCH_WINDOW and grows up to
+    MAX_WORKERS: by one per completed fetch (so it doubles each round), and
+    doubles whenever none completes within FETCH_WINDOW_GROW_INTERVAL, i.e.
+    while peers without an index are stalling until the cat timeout.
+
+    Returns [(peer_id, {name: (key_id, resolved_path_or_none)})].
+    """
     many_peers = len(peers) > MANY_PEERS_THRESHOLD
     cat_timeout = FAST_CAT_TIMEOUT if many_peers else ipfs.DEFAULT_CAT_TIMEOUT
+    progress = None
+    if many_peers:
+        # Imported here: only large scans show a progress bar
+        from tqdm import tqdm
+
+        progress = tqdm(total=len(peers), desc="Scanning peers")
+
+    queued = deque(peers)
+    window = INITIAL_FETCH_WINDOW
+    index_futures: dict[Future, str] = {}
+    peer_keys: dict[str, dict[str, str]] = {}
+    # Keyed by key_id: a key listed by several names or peers resolves once
+    resolve_futures: dict[str, Future] = {}
+    while queued or index_futures:
+        while queued and len(index_futures) < window:
+            pid = queued.popleft()
+            index_futures[_IO_POOL.submit(_fetch_peer_index, pid, cat_timeout)] = pid
+
+        done, _ = wait(
+            index_futures,
+            timeout=FETCH_WINDOW_GROW_INTERVAL,
+            return_when=FIRST_COMPLETED,
+        )
+        if not done:
+            window = min(window * 2, MAX_WORKERS)
+            continue
 
-    results: list[tuple[str, dict[str, tuple[str, str | None]]]] = []
-    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(peers))) as pool:
-        futures = {
-            pool.submit(_fetch_peer_index, pid, cat_timeout): pid for pid in peers
-        }
-        iterator = as_completed(futures)
-        if many_peers:
-            iterator = tqdm(iterator, total=len(peers), desc="Scanning peers")
-        for future in iterator:
-            result = future.result()
-            if result:
-                results.append(result)
-    return results
+        window = min(window + len(done), MAX_WORKERS)
+        for future in done:
+            peer_id = index_futures.pop(future)
+            if progress:
+                progress.update()
+            ipns_keys = future.result()
+            if not ipns_keys:
+                continue
+            peer_keys[peer_id] = ipns_keys
+            for key_id in ipns_keys.values():
+                if key_id not in resolve_futures:
+                    resolve_futures[key_id] = _IO_POOL.submit(_resolve_key, key_id)
+
+    if progress:
+        progress.close()
+    db.record_failed_peers(pid for pid in peers if pid not in peer_keys)
+    return [
+        (
+            peer_id,
+            {
+                name: (key_id, resolve_futures[key_id].result())
+                for name, key_id in ipns_keys.items()
+            },
+        )
+        for peer_id, ipns_keys in peer_keys.items()
+    ]
 
 
 def _publish_entry(key: str, dir_path: Path, ipns_name: str) -> str | None:
     """Add directory and publish under IPNS name. Returns CID on success."""
-    if not dir_path.is_dir():
-        click.echo(f"  {key}: skipped (directory not found at {dir_path})")
-        return None
     try:
         cid = ipfs.add_directory(str(dir_path))
-        ipfs.name_publish(cid, key=key, ttl="1m")
+        _publish_cid(cid, key=key)
         click.echo(f"  {key}: ipns://{ipns_name}")
         click.echo(f"  {key}: ipfs://{cid}")
         if key != "(index)":
             click.echo(f"  {key}: https://{ipns_name}.ipns.dweb.link")
         return cid
-    except subprocess.CalledProcessError:
+    except FileNotFoundError:
+        click.echo(f"  {key}: skipped (directory not found at {dir_path})")
+        return None
+    except ipfs.IpfsError:
         click.echo(f"  {key}: failed")
         return None
 
@@ -194,17 +314,25 @@ def index() -> None:
         click.echo("\nDiscovered keys:")
         pinned_cids = ipfs.pin_ls()
 
-        # Group by node_id
-        peers: dict[str, list[dict]] = {}
-        for row in discovered:
-            peers.setdefault(row["node_id"], []).append(row)
+        # Resolve all discovered keys concurrently before rendering
+        ipns_names = list({row["ipns_name"] for row in discovered})
+        resolve = partial(_resolve_key, timeout=PIN_CHECK_TIMEOUT)
+        resolved = dict(zip(ipns_names, _IO_POOL.map(resolve, ipns_names)))
 
-        for node_id, rows in peers.items():
+        # Rows come sorted by node_id, so grouping is a single pass
+        for node_id, rows in groupby(discovered, key=itemgetter("node_id")):
             click.echo(f"  Peer: {node_id}")
             for row in rows:
-                pinned = ipfs.is_pinned(row["ipns_name"], pinned_cids)
+                path = resolved[row["ipns_name"]]
+                pinned = path is not None and path.rpartition("/")[2] in pinned_cids
                 pin_marker = " [pinned]" if pinned else ""
                 key = row["name"] or "(index)"
+                if _immutable_path(row["ipns_name"]):
+                    # Listed by CID: link the content itself
+                    cid = path.rpartition("/")[2]
+                    click.echo(f"    {key}: ipfs://{cid}{pin_marker}")
+                    click.echo(f"    {key}: https://{cid}.ipfs.dweb.link")
+                    continue
                 click.echo(f"    {key}: ipns://{row['ipns_name']}{pin_marker}")
                 if key != "(index)":
                     click.echo(f"    {key}: https://{row['ipns_name']}.ipns.dweb.link")
@@ -226,20 +354,17 @@ def add(dir_path: Path) -> None:
 
     key_name = click.prompt("Name", default=default_name)
 
-    keys = ipfs.key_list()
-    if key_name not in keys:
+    ipns_name = ipfs.key_list().get(key_name)
+    if ipns_name is None:
         click.echo(f"Creating IPNS key: {key_name}")
-        ipfs.key_gen(key_name)
+        ipns_name = ipfs.key_gen(key_name)
 
     click.echo(f"Adding {dir_path} to IPFS...")
     cid = ipfs.add_directory(str(abs_path))
     click.echo(f"ipfs://{cid}")
 
     click.echo(f"Publishing under IPNS key: {key_name}...")
-    ipfs.name_publish(cid, key=key_name, ttl="1m")
-
-    keys = ipfs.key_list()
-    ipns_name = keys.get(key_name, "")
+    _publish_cid(cid, key=key_name)
     click.echo(f"ipns://{ipns_name}")
 
     db.upsert_published(str(abs_path), key_name)
@@ -276,6 +401,16 @@ def publish() -> None:
         click.echo("No directories were published successfully.")
         return
 
+    index_hash = _index_hash(published_keys)
+    state = _current_index_state(index_hash)
+    if state:
+        click.echo("Discovery index unchanged, not republishing.")
+        click.echo(f"  ipns://{ipfs.node_id()}")
+        click.echo(f"  ipfs://{state['cid']}")
+        return
+
+    import tempfile
+
     discovery_dir = Path(tempfile.mkdtemp(prefix="fipsy-index-"))
     try:
         _write_index_json(discovery_dir, published_keys)
@@ -283,44 +418,63 @@ def publish() -> None:
 
         click.echo("Publishing discovery index under IPNS self...")
         cid = ipfs.add_directory(str(discovery_dir))
-        ipfs.name_publish(cid, ttl="1m")
+        _publish_cid(cid)
+        db.set_publish_state(index_hash, cid)
         click.echo(f"  ipns://{ipfs.node_id()}")
         click.echo(f"  ipfs://{cid}")
     finally:
         shutil.rmtree(discovery_dir, ignore_errors=True)
 
 
+def _index_hash(keys: dict[str, str]) -> str:
+    return hashlib.blake2b(json.dumps(sorted(keys.items())).encode()).hexdigest()
+
+
+def _current_index_state(index_hash: str) -> sqlite3.Row | None:
+    """Return the last publish state if it matches index_hash and is recent."""
+    state = db.get_publish_state()
+    if (
+        state
+        and state["hash"] == index_hash
+        and time.time() - state["published_at"] < INDEX_REPUBLISH_INTERVAL
+    ):
+        return state
+    return None
+
+
 def _write_index_json(directory: Path, keys: dict[str, str]) -> None:
     data = {"ipns": keys}
-    (directory / "index.json").write_text(json.dumps(data, indent=2))
+    (directory / "index.json").write_bytes(json.dumps(data, indent=2).encode())
+
+
+_INDEX_HTML_HEAD = """\
+<!doctype html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>IPNS Index</title>
+  <style>
+    body { font-family: sans-serif; padding: 2rem; }
+    li { margin: 0.5rem 0; }
+    code { background: #eee; padding: 0.2rem 0.4rem; }
+  </style>
+</head>
+<body>
+  <h1>IPNS Index</h1>
+  <ul>
+"""
+
+_INDEX_HTML_TAIL = """\
+  </ul>
+</body>
+</html>
+"""
 
 
 def _write_index_html(directory: Path, keys: dict[str, str]) -> None:
-    lines = [
-        "<!doctype html>",
-        "<html>",
-        "<head>",
-        '  <meta charset="utf-8">',
-        "  <title>IPNS Index</title>",
-        "  <style>",
-        "    body { font-family: sans-serif; padding: 2rem; }",
-        "    li { margin: 0.5rem 0; }",
-        "    code { background: #eee; padding: 0.2rem 0.4rem; }",
-        "  </style>",
-        "</head>",
-        "<body>",
-        "  <h1>IPNS Index</h1>",
-        "  <ul>",
-    ]
-    for key_name, ipns_name in keys.items():
-        lines.append(
-            f'    <li><a href="ipns://{ipns_name}">{key_name}</a> <code>{ipns_name}</code></li>'
-        )
-    lines.extend(
-        [
-            "  </ul>",
-            "</body>",
-            "</html>",
-        ]
+    items = "".join(
+        f'    <li><a href="ipns://{ipns_name}">{key_name}</a> <code>{ipns_name}</code></li>\n'
+        for key_name, ipns_name in keys.items()
     )
-    (directory / "index.html").write_text("\n".join(lines) + "\n")
+    html = _INDEX_HTML_HEAD + items + _INDEX_HTML_TAIL
+    (directory / "index.html").write_bytes(html.encode())
@@ -1,21 +1,95 @@
 """SQLite storage for discovered IPNS keys."""
 
+import atexit
 import sqlite3
+import threading
+import time
+from collections.abc import Iterable, Iterator, Sequence
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
 
 DB_PATH = Path.home() / ".config" / "fipsy" / "discovered.db"
 
+# Matches the 1-minute TTL fipsy publishes its IPNS records with
+DEFAULT_RESOLVED_TTL = 60
+
+
+# Statements on the scan hot path. sqlite3 caches prepared statements per
+# connection keyed by SQL text, so with the shared connection these are
+# parsed once per process.
+_UPSERT_DISCOVERED_SQL = """
+    INSERT INTO discovered (node_id, ipns_name, name)
+    VALUES (?, ?, ?)
+    ON CONFLICT(node_id, ipns_name) DO UPDATE SET
+        name = excluded.name
+"""
+_GET_RESOLVED_SQL = "SELECT path, resolved_at, ttl FROM resolved WHERE ipns_name = ?"
+_PUT_RESOLVED_SQL = """
+    INSERT OR REPLACE INTO resolved (ipns_name, path, resolved_at, ttl)
+    VALUES (?, ?, ?, ?)
+"""
+
+# The connection is shared by the TUI's worker threads; serialize access so one
+# thread never commits another thread's half-done transaction.
+# Callers must hold _lock when calling _get_connection().
+_lock = threading.Lock()
+_conn: sqlite3.Connection | None = None
+
 
 def _get_connection() -> sqlite3.Connection:
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    global _conn
+    if _conn is None:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit: single statements commit on their own, multi-statement
+        # writes open an explicit transaction via _transaction()
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        _conn.row_factory = sqlite3.Row
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute("PRAGMA temp_store=MEMORY")
+        _conn.execute("PRAGMA cache_size=-64000")  # KiB, i.e. up to ~64 MB
+    return _conn
+
+
+@contextmanager
+def _locked() -> Iterator[sqlite3.Connection]:
+    """Hold the lock and yield the shared connection in autocommit mode."""
+    with _lock:
+        yield _get_connection()
+
+
+@contextmanager
+def _transaction() -> Iterator[sqlite3.Connection]:
+    """Hold the lock and run the block in one BEGIN ... COMMIT transaction."""
+    with _lock:
+        conn = _get_connection()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            # A failed COMMIT (e.g. SQLITE_BUSY) leaves the transaction open
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+
+def close() -> None:
+    """Close the shared connection. The next DB call reopens it."""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+atexit.register(close)
 
 
 def init_db() -> None:
     """Initialize the database schema."""
-    with _get_connection() as conn:
+    with _transaction() as conn:
         conn.execute("""
             CREATE TABLE IF NOT EXISTS discovered (
                 node_id TEXT NOT NULL,
@@ -24,6 +98,11 @@ def init_db() -> None:
                 PRIMARY KEY (node_id, ipns_name)
             )
         """)
+        # Lets list_discovered walk rows in (node_id, name) order without a sort
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_discovered_node_name
+            ON discovered (node_id, name)
+        """)
         conn.execute("""
             CREATE TABLE IF NOT EXISTS published (
                 path TEXT PRIMARY KEY,
@@ -31,39 +110,56 @@ def init_db() -> None:
                 added TEXT NOT NULL
             )
         """)
-        conn.commit()
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_published_key ON published (key)
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS resolved (
+                ipns_name TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                resolved_at REAL NOT NULL,
+                ttl INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS publish_state (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                hash TEXT NOT NULL,
+                cid TEXT NOT NULL,
+                published_at REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS failed_peers (
+                peer_id TEXT PRIMARY KEY,
+                failed_at REAL NOT NULL
+            )
+        """)
 
 
 def upsert_discovered(node_id: str, ipns_name: str, name: str | None = None) -> None:
     """Insert or update a discovered IPNS key or peer index."""
-    with _get_connection() as conn:
-        conn.execute(
-            """
-            INSERT INTO discovered (node_id, ipns_name, name)
-            VALUES (?, ?, ?)
-            ON CONFLICT(node_id, ipns_name) DO UPDATE SET
-                name = excluded.name
-            """,
-            (node_id, ipns_name, name),
-        )
-        conn.commit()
+    upsert_discovered_many([(node_id, ipns_name, name)])
 
 
-def list_discovered() -> list[dict]:
+def upsert_discovered_many(rows: Iterable[tuple[str, str, str | None]]) -> None:
+    """Insert or update (node_id, ipns_name, name) rows in a single transaction."""
+    with _transaction() as conn:
+        conn.executemany(_UPSERT_DISCOVERED_SQL, rows)
+
+
+def list_discovered() -> list[sqlite3.Row]:
     """List all discovered IPNS names."""
-    with _get_connection() as conn:
-        rows = conn.execute(
+    with _locked() as conn:
+        return conn.execute(
             "SELECT node_id, ipns_name, name FROM discovered ORDER BY node_id, name"
         ).fetchall()
-        return [dict(row) for row in rows]
 
 
 def upsert_published(path: str, key: str) -> None:
     """Insert or update a published directory."""
-    from datetime import datetime, timezone
-
     added = datetime.now(timezone.utc).isoformat()
-    with _get_connection() as conn:
+    with _locked() as conn:
         conn.execute(
             """
             INSERT INTO published (path, key, added)
@@ -74,21 +170,102 @@ def upsert_published(path: str, key: str) -> None:
             """,
             (path, key, added),
         )
-        conn.commit()
 
 
-def list_published() -> list[dict]:
+def list_published() -> list[sqlite3.Row]:
     """List all published directories."""
-    with _get_connection() as conn:
-        rows = conn.execute(
+    with _locked() as conn:
+        return conn.execute(
             "SELECT path, key, added FROM published ORDER BY key"
         ).fetchall()
-        return [dict(row) for row in rows]
+
+
+def list_browse_rows() -> list[sqlite3.Row]:
+    """List published and discovered keys together for the Browse tab.
+
+    Each row has `kind` ('published' or 'discovered'), `name`, `source` (the
+    directory path or the discovering node ID) and `ipns_name` (NULL for
+    published rows, whose IPNS name comes from the daemon's key list).
+    Discovered rows come first, ordered by node and name.
+    """
+    with _locked() as conn:
+        return conn.execute("""
+            SELECT 'discovered' AS kind, name, node_id AS source, ipns_name
+            FROM discovered
+            UNION ALL
+            SELECT 'published', key, path, NULL
+            FROM published
+            ORDER BY kind, source, name
+        """).fetchall()
 
 
 def delete_published(path: str) -> bool:
     """Delete a published directory by path. Returns True if deleted."""
-    with _get_connection() as conn:
-        cursor = conn.execute("DELETE FROM published WHERE path = ?", (path,))
-        conn.commit()
-        return cursor.rowcount > 0
+    return delete_published_many([path]) > 0
+
+
+def delete_published_many(paths: Sequence[str]) -> int:
+    """Delete published directories by path in one statement. Returns the count."""
+    if not paths:
+        return 0
+    placeholders = ",".join("?" * len(paths))
+    with _locked() as conn:
+        cursor = conn.execute(
+            f"DELETE FROM published WHERE path IN ({placeholders})", paths
+        )
+        return cursor.rowcount
+
+
+def get_resolved(ipns_name: str) -> str | None:
+    """Return the cached resolved path for an IPNS name if still within TTL."""
+    with _locked() as conn:
+        row = conn.execute(_GET_RESOLVED_SQL, (ipns_name,)).fetchone()
+    if row is None or time.time() - row["resolved_at"] >= row["ttl"]:
+        return None
+    return row["path"]
+
+
+def put_resolved(ipns_name: str, path: str, ttl: int = DEFAULT_RESOLVED_TTL) -> None:
+    """Cache the resolved path of an IPNS name."""
+    with _locked() as conn:
+        conn.execute(_PUT_RESOLVED_SQL, (ipns_name, path, time.time(), ttl))
+
+
+def get_failed_peers(max_age: float) -> set[str]:
+    """Return peers whose index fetch failed within the last `max_age` seconds."""
+    with _locked() as conn:
+        rows = conn.execute(
+            "SELECT peer_id FROM failed_peers WHERE failed_at > ?",
+            (time.time() - max_age,),
+        ).fetchall()
+    return {row["peer_id"] for row in rows}
+
+
+def record_failed_peers(peer_ids: Iterable[str]) -> None:
+    """Record that fetching these peers' indexes just failed."""
+    now = time.time()
+    with _transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO failed_peers (peer_id, failed_at) VALUES (?, ?)",
+            ((peer_id, now) for peer_id in peer_ids),
+        )
+
+
+def get_publish_state() -> sqlite3.Row | None:
+    """Return the hash, CID and time of the last published discovery index."""
+    with _locked() as conn:
+        return conn.execute(
+            "SELECT hash, cid, published_at FROM publish_state WHERE id = 0"
+        ).fetchone()
+
+
+def set_publish_state(index_hash: str, cid: str) -> None:
+    """Record the discovery index that was just published."""
+    with _locked() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO publish_state (id, hash, cid, published_at)
+            VALUES (0, ?, ?, ?)
+            """,
+            (index_hash, cid, time.time()),
+        )
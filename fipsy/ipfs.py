@@ -1,99 +1,307 @@
-"""Pure wrappers around the `ipfs` CLI binary."""
+"""Pure wrappers around the `ipfs` CLI binary and the daemon's RPC API."""
 
+import http.client
+import json
+import os
 import shutil
 import subprocess
+import threading
 import time
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from urllib.parse import quote, urlencode
 
 DAEMON_STARTUP_TIMEOUT = 15
-DAEMON_POLL_INTERVAL = 1
+DAEMON_POLL_INTERVAL = 0.1
+DEFAULT_API_ADDR = ("127.0.0.1", 5001)
 
 
-def run_ipfs(*args: str, timeout: float | None = None) -> str:
-    result = subprocess.run(
-        ["ipfs", *args],
-        capture_output=True,
-        text=True,
-        check=True,
-        timeout=timeout,
-    )
-    return result.stdout.strip()
+class IpfsError(Exception):
+    """An RPC call to the IPFS daemon failed."""
+
+
+_ipfs_found: str | None = None
+
+
+def _ipfs_path() -> str | None:
+    """Locate the `ipfs` binary on PATH, remembering it once found.
+
+    A miss is not remembered, so a later install is picked up.
+    """
+    global _ipfs_found
+    if _ipfs_found is None:
+        _ipfs_found = shutil.which("ipfs")
+    return _ipfs_found
+
+
+def _ipfs_binary() -> str:
+    # An absolute executable path lets subprocess use posix_spawn
+    return _ipfs_path() or "ipfs"
+
+
+def _api_addr() -> tuple[str, int]:
+    """Read the daemon's RPC address from the repo's `api` file."""
+    repo = Path(os.environ.get("IPFS_PATH", Path.home() / ".ipfs"))
+    try:
+        # Multiaddr like /ip4/127.0.0.1/tcp/5001
+        parts = (repo / "api").read_text().strip().split("/")
+        return parts[2], int(parts[4])
+    except (OSError, IndexError, ValueError):
+        return DEFAULT_API_ADDR
+
+
+# One keep-alive connection per thread (http.client is not thread-safe)
+_local = threading.local()
+
+# Read-only commands, safe to send again if the first attempt may have landed
+_RETRYABLE_COMMANDS = frozenset(
+    {"id", "cat", "name/resolve", "key/list", "pin/ls", "swarm/peers"}
+)
+
+
+def _connection(timeout: float | None) -> http.client.HTTPConnection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        host, port = _api_addr()
+        conn = http.client.HTTPConnection(host, port)
+        _local.conn = conn
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+    return conn
+
+
+def rpc(
+    command: str,
+    *args: str,
+    timeout: float | None = None,
+    body: Iterable[bytes] | None = None,
+    headers: dict[str, str] | None = None,
+    **options,
+) -> bytes:
+    """Call `/api/v0/{command}` on the daemon and return the raw response body.
+
+    Positional args are sent as `arg` params; keyword options are sent with
+    underscores replaced by dashes (e.g. cid_version -> cid-version).
+    An iterable `body` is streamed with chunked transfer encoding.
+    """
+    params = [("arg", arg) for arg in args]
+    for name, value in options.items():
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        params.append((name.replace("_", "-"), str(value)))
+
+    url = f"/api/v0/{command}?{urlencode(params)}"
+    conn = _connection(timeout)
+    # A kept-alive connection may have been closed by the other end (e.g. a
+    # daemon restart); a read-only request on it is sent once more
+    retry = command in _RETRYABLE_COMMANDS and conn.sock is not None
+    try:
+        try:
+            conn.request("POST", url, body=body, headers=headers or {})
+            response = conn.getresponse()
+        except (
+            http.client.RemoteDisconnected,
+            ConnectionResetError,
+            BrokenPipeError,
+        ):
+            if not retry:
+                raise
+            conn.close()
+            _local.conn = None
+            conn = _connection(timeout)
+            conn.request("POST", url, headers=headers or {})
+            response = conn.getresponse()
+        body = response.read()
+    except (OSError, http.client.HTTPException) as e:
+        # Drop the connection so the next call re-reads the api file, which
+        # only appears once the daemon is up
+        conn.close()
+        _local.conn = None
+        raise IpfsError(f"{command}: {e}") from e
+
+    if response.status != 200:
+        try:
+            message = json.loads(body)["Message"]
+        except (ValueError, KeyError, TypeError):
+            message = body.decode(errors="replace").strip()
+        raise IpfsError(f"{command}: {message}")
+    return body
 
 
 def is_installed() -> bool:
-    return shutil.which("ipfs") is not None
+    return _ipfs_path() is not None
+
+
+DAEMON_PROBE_TIMEOUT = 2
+
+# Peer ID of the local node, remembered from the first successful `id` call
+_node_id: str | None = None
 
 
 def is_daemon_running() -> bool:
+    global _node_id
     try:
-        run_ipfs("id")
+        _node_id = json.loads(rpc("id", timeout=DAEMON_PROBE_TIMEOUT))["ID"]
         return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    except IpfsError:
         return False
 
 
 def start_daemon() -> None:
+    # IPNS over pubsub: once a name has been resolved, the daemon stays
+    # subscribed and later resolves of it are answered without a DHT walk
     subprocess.Popen(
-        ["ipfs", "daemon", "--init"],
+        [_ipfs_binary(), "daemon", "--init", "--enable-namesys-pubsub"],
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
     )
-    elapsed = 0
-    while elapsed < DAEMON_STARTUP_TIMEOUT:
+    # Probes are cheap RPC calls (refused until the API is up), so poll often
+    deadline = time.monotonic() + DAEMON_STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
         time.sleep(DAEMON_POLL_INTERVAL)
-        elapsed += DAEMON_POLL_INTERVAL
         if is_daemon_running():
             return
     raise RuntimeError("IPFS daemon failed to start within timeout")
 
 
 def node_id() -> str:
-    return run_ipfs("id", "-f=<id>")
+    global _node_id
+    if _node_id is None:
+        _node_id = json.loads(rpc("id"))["ID"]
+    return _node_id
 
 
 def swarm_peers() -> list[str]:
-    output = run_ipfs("swarm", "peers")
-    if not output:
-        return []
-    # Each line is a multiaddr like /ip4/.../p2p/<peer_id>
-    return list({line.rstrip("/").split("/")[-1] for line in output.splitlines()})
+    peers = json.loads(rpc("swarm/peers"))["Peers"] or []
+    return list({peer["Peer"] for peer in peers})
 
 
 DEFAULT_CAT_TIMEOUT = 5
 
 
-def cat_path(path: str, timeout: float = DEFAULT_CAT_TIMEOUT) -> str:
-    return run_ipfs("cat", path, timeout=timeout)
+def cat_path(
+    path: str, timeout: float = DEFAULT_CAT_TIMEOUT, length: int | None = None
+) -> bytes:
+    """Return the raw content at path, at most `length` bytes if given."""
+    if length is None:
+        return rpc("cat", path, timeout=timeout)
+    return rpc("cat", path, timeout=timeout, length=length)
+
+
+KEY_CACHE_TTL = 5
+_key_cache: tuple[float, dict[str, str]] | None = None
 
 
 def key_list() -> dict[str, str]:
-    """Return {name: key_id} for all IPNS keys."""
-    output = run_ipfs("key", "list", "-l")
-    keys: dict[str, str] = {}
-    for line in output.splitlines():
-        parts = line.split()
-        if len(parts) >= 2:
-            key_id, name = parts[0], parts[1]
-            keys[name] = key_id
-    return keys
+    """Return {name: key_id} for all IPNS keys. Cached for KEY_CACHE_TTL seconds.
+
+    `key_gen` clears the cache; keys made by another process show up once
+    it expires.
+    """
+    global _key_cache
+    if _key_cache and time.monotonic() - _key_cache[0] < KEY_CACHE_TTL:
+        return _key_cache[1]
+    keys = json.loads(rpc("key/list", l=True))["Keys"] or []
+    key_ids = {key["Name"]: key["Id"] for key in keys}
+    _key_cache = (time.monotonic(), key_ids)
+    return key_ids
 
 
 def key_gen(name: str) -> str:
-    return run_ipfs("key", "gen", name)
+    global _key_cache
+    key_id = json.loads(rpc("key/gen", name))["Id"]
+    _key_cache = None
+    return key_id
+
+
+ADD_BOUNDARY = "fipsy-add-boundary"
+ADD_READ_SIZE = 256 * 1024
+
+
+def _multipart_part(name: str, content_type: str) -> bytes:
+    filename = quote(name, safe="")
+    return (
+        f"--{ADD_BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode()
+
+
+def _multipart_tree(name: str, entries: Iterator[os.DirEntry]) -> Iterator[bytes]:
+    """Yield the multipart body for a directory, parents before children.
+
+    Hidden files are skipped and symlinks are stored as links, like `ipfs add -r`.
+    """
+    yield _multipart_part(name, "application/x-directory") + b"\r\n"
+    with entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            if entry.name.startswith("."):
+                continue
+            child = f"{name}/{entry.name}"
+            if entry.is_symlink():
+                yield _multipart_part(child, "application/symlink")
+                yield os.readlink(entry.path).encode() + b"\r\n"
+            elif entry.is_dir():
+                yield from _multipart_tree(child, os.scandir(entry.path))
+            else:
+                yield _multipart_part(child, "application/octet-stream")
+                with open(entry.path, "rb") as f:
+                    while chunk := f.read(ADD_READ_SIZE):
+                        yield chunk
+                yield b"\r\n"
 
 
 def add_directory(dir_path: str) -> str:
-    """Add directory recursively, return root CID v1."""
-    return run_ipfs("add", "-r", "-Q", "--cid-version=1", "--raw-leaves", dir_path)
+    """Add directory recursively, return root CID v1.
+
+    Raises FileNotFoundError if dir_path is not a directory, and IpfsError if
+    it cannot be read or the daemon rejects the add.
+    """
+    try:
+        entries = os.scandir(dir_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise FileNotFoundError(f"Directory not found: {dir_path}") from None
+    except OSError as e:
+        raise IpfsError(f"add: {e}") from e
+
+    name = os.path.basename(os.path.abspath(dir_path))
+
+    def body() -> Iterator[bytes]:
+        yield from _multipart_tree(name, entries)
+        yield f"--{ADD_BOUNDARY}--\r\n".encode()
+
+    # Also closes the listing if rpc fails before the body is read
+    with entries:
+        out = rpc(
+            "add",
+            body=body(),
+            headers={"Content-Type": f"multipart/form-data; boundary={ADD_BOUNDARY}"},
+            quieter=True,
+            cid_version=1,
+            raw_leaves=True,
+        )
+    # One JSON object per added entry, the root directory comes last
+    return json.loads(out.splitlines()[-1])["Hash"]
 
 
 DEFAULT_RESOLVE_TIMEOUT = 10
 
 
 def name_resolve(key_id: str, timeout: float = DEFAULT_RESOLVE_TIMEOUT) -> str:
-    """Resolve an IPNS key to its current IPFS path."""
-    return run_ipfs(
-        "name", "resolve", "--recursive", f"/ipns/{key_id}", timeout=timeout
+    """Resolve an IPNS key to its current IPFS path.
+
+    Keys owned by this node are resolved offline from the local repo, which
+    holds their latest record, instead of going through the DHT.
+    """
+    body = rpc(
+        "name/resolve",
+        f"/ipns/{key_id}",
+        timeout=timeout,
+        recursive=True,
+        offline=key_id in key_list().values(),
     )
+    return json.loads(body)["Path"]
 
 
 def name_publish(
@@ -102,43 +310,29 @@ def name_publish(
     lifetime: str | None = None,
     ttl: str | None = None,
 ) -> str:
-    args = ["name", "publish"]
-    if key:
-        args.append(f"--key={key}")
-    if lifetime:
-        args.append(f"--lifetime={lifetime}")
-    if ttl:
-        args.append(f"--ttl={ttl}")
-    args.append(f"/ipfs/{cid}")
-    return run_ipfs(*args)
-
-
-def pin_add(cid: str, recursive: bool = True) -> str:
+    """Publish a CID under an IPNS key (default: self). Returns the IPNS name."""
+    options = {"key": key, "lifetime": lifetime, "ttl": ttl}
+    options = {name: value for name, value in options.items() if value}
+    return json.loads(rpc("name/publish", f"/ipfs/{cid}", **options))["Name"]
+
+
+def pin_add(cid: str, recursive: bool = True) -> None:
     """Pin a CID to local storage."""
-    args = ["pin", "add"]
-    if recursive:
-        args.append("--recursive=true")
-    else:
-        args.append("--recursive=false")
-    args.append(cid)
-    return run_ipfs(*args)
-
-
-def pin_ls() -> set[str]:
-    """List all pinned CIDs."""
-    output = run_ipfs("pin", "ls", "--type=recursive", "-q")
-    if not output:
-        return set()
-    return set(output.splitlines())
-
-
-def is_pinned(ipns_key: str, pinned_cids: set[str] | None = None) -> bool:
-    """Check if an IPNS key's resolved content is pinned."""
-    if pinned_cids is None:
-        pinned_cids = pin_ls()
-    try:
-        resolved = name_resolve(ipns_key, timeout=5)
-        cid = resolved.split("/")[-1]
-        return cid in pinned_cids
-    except Exception:
-        return False
+    global _pin_cache
+    rpc("pin/add", cid, recursive=recursive)
+    _pin_cache = None
+
+
+PIN_CACHE_TTL = 5
+_pin_cache: tuple[float, frozenset[str]] | None = None
+
+
+def pin_ls() -> frozenset[str]:
+    """List all pinned CIDs. Cached for PIN_CACHE_TTL seconds."""
+    global _pin_cache
+    if _pin_cache and time.monotonic() - _pin_cache[0] < PIN_CACHE_TTL:
+        return _pin_cache[1]
+    pins = json.loads(rpc("pin/ls", type="recursive", quiet=True))["Keys"] or {}
+    pinned = frozenset(pins)
+    _pin_cache = (time.monotonic(), pinned)
+    return pinned
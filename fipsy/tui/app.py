@@ -18,15 +18,52 @@ from textual.widgets import (
 )
 
 from fipsy import db
+from fipsy.commands import _immutable_path
 from fipsy.tui import workers
 from fipsy.tui.screens import AddDirectoryScreen, ConfirmScreen, IpfsErrorScreen
-from fipsy.tui.widgets import BrowseTable, PeerTable, PublishedTable
+from fipsy.tui.widgets import BrowseTable, PeerTable, PublishedTable, Row
 
 TRUNCATE_LEN = 12
+# Scan results are handed to the UI thread in batches of this size or age
+SCAN_FLUSH_SIZE = 16
+SCAN_FLUSH_INTERVAL = 0.05
 
 
 def _trunc(s: str, n: int = TRUNCATE_LEN) -> str:
-    return s[:n] + ".." if len(s) > n + 2 else s
+    return s if len(s) <= n + 2 else f"{s[:n]}.."
+
+
+# Rows are built in worker threads so the UI thread only has to add them
+def _peer_rows(results: list[workers.ScanResult]) -> list[Row]:
+    # Keyed by name: an index may list one IPNS key under several names
+    return [
+        (
+            f"{entry.peer_id}:{entry.name}",
+            (
+                _trunc(entry.peer_id),
+                entry.name,
+                _trunc(entry.ipns_name),
+                _trunc(entry.cid) if entry.cid else "unresolved",
+            ),
+        )
+        for result in results
+        for entry in result.entries
+    ]
+
+
+def _browse_rows(entries: list[workers.BrowseEntry]) -> list[Row]:
+    return [
+        (
+            entry.ipns_name,
+            (
+                entry.name,
+                entry.source,
+                _trunc(entry.ipns_name),
+                "yes" if entry.pinned else "",
+            ),
+        )
+        for entry in entries
+    ]
 
 
 class FipsyApp(App):
@@ -157,7 +194,8 @@ class FipsyApp(App):
         self.run_worker(self._scan_worker, thread=True, exclusive=True, group="scan")
 
     def _scan_worker(self) -> None:
-        for item in workers.scan_peers_iter():
+        scan = workers.scan_peers_iter(SCAN_FLUSH_SIZE, SCAN_FLUSH_INTERVAL)
+        for item in scan:
             if isinstance(item, int):
                 self._scan_total = item
                 if item == 0:
@@ -167,11 +205,10 @@ class FipsyApp(App):
                     self._scan_update_status, f"Scanning {item} peer(s)..."
                 )
             else:
-                self._scan_done += 1
+                self._scan_done += len(item)
                 pct = (self._scan_done / self._scan_total) * 100
-                self.call_from_thread(self._scan_update_progress, pct)
-                if item is not None:
-                    self.call_from_thread(self._scan_add_result, item)
+                rows = _peer_rows([result for result in item if result is not None])
+                self.call_from_thread(self._scan_add_rows, rows, pct)
 
         self.call_from_thread(self._scan_complete)
 
@@ -182,19 +219,11 @@ class FipsyApp(App):
     def _scan_update_status(self, msg: str) -> None:
         self.query_one("#network-status", Static).update(msg)
 
-    def _scan_update_progress(self, pct: float) -> None:
-        self.query_one("#scan-bar", ProgressBar).update(progress=pct)
-
-    def _scan_add_result(self, result: workers.ScanResult) -> None:
+    def _scan_add_rows(self, rows: list[Row], pct: float) -> None:
         table = self.query_one("#peer-table", PeerTable)
-        for entry in result.entries:
-            table.add_row(
-                _trunc(entry.peer_id),
-                entry.name,
-                _trunc(entry.ipns_name),
-                _trunc(entry.cid) if entry.cid else "unresolved",
-                key=f"{entry.peer_id}:{entry.ipns_name}",
-            )
+        with self.batch_update():
+            self.query_one("#scan-bar", ProgressBar).update(progress=pct)
+            table.populate(rows)
 
     def _scan_complete(self) -> None:
         table = self.query_one("#peer-table", PeerTable)
@@ -222,7 +251,7 @@ class FipsyApp(App):
 
         status.update(f"{len(published)} published directory(s)")
         for entry in published:
-            added = entry["added"][:10] if entry.get("added") else ""
+            added = entry["added"][:10]
             table.add_row(
                 entry["key"],
                 _trunc(entry["path"], 30),
@@ -371,24 +400,17 @@ class FipsyApp(App):
         )
 
     def _browse_worker(self) -> None:
-        entries = workers.get_browse_entries()
-        self.call_from_thread(self._browse_loaded, entries)
+        rows = _browse_rows(workers.get_browse_entries())
+        self.call_from_thread(self._browse_loaded, rows)
 
-    def _browse_loaded(self, entries: list[workers.BrowseEntry]) -> None:
+    def _browse_loaded(self, rows: list[Row]) -> None:
         table = self.query_one("#browse-table", BrowseTable)
-        table.clear()
-
-        for entry in entries:
-            table.add_row(
-                entry.name,
-                entry.source,
-                _trunc(entry.ipns_name),
-                "yes" if entry.pinned else "",
-                key=entry.ipns_name,
-            )
+        with self.batch_update():
+            table.clear()
+            table.populate(rows)
 
         status = self.query_one("#browse-status", Static)
-        status.update(f"{len(entries)} IPNS key(s)")
+        status.update(f"{len(rows)} IPNS key(s)")
 
     def action_pin(self) -> None:
         if not self._require_ipfs():
@@ -447,16 +469,14 @@ class FipsyApp(App):
             )
 
     def _pin_ipns_worker(self, ipns_name: str) -> None:
-        import subprocess
-
         from fipsy import ipfs as _ipfs
 
         try:
-            resolved = _ipfs.name_resolve(ipns_name)
-            cid = resolved.split("/")[-1]
+            resolved = _immutable_path(ipns_name) or _ipfs.name_resolve(ipns_name)
+            cid = resolved.rpartition("/")[2]
             _ipfs.pin_add(cid)
             self.call_from_thread(self.notify, f"Pinned {_trunc(cid)}")
-        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        except _ipfs.IpfsError:
             self.call_from_thread(
                 self.notify, f"Pin failed for {_trunc(ipns_name)}", severity="error"
             )
@@ -488,7 +508,9 @@ class FipsyApp(App):
             self._open_directory(path)
 
     def _open_ipns(self, ipns_name: str) -> None:
-        url = f"http://ipfs.io/ipns/{ipns_name}"
+        # Entries listed by CID open the content itself
+        path = _immutable_path(ipns_name) or f"/ipns/{ipns_name}"
+        url = f"http://ipfs.io{path}"
         webbrowser.open(url)
         self.notify(f"Opening {_trunc(ipns_name)}")
 
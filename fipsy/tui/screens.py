@@ -3,14 +3,27 @@
 from textual.app import ComposeResult
 from textual.containers import Horizontal, Vertical
 from textual.screen import ModalScreen
+from textual.timer import Timer
 from textual.widgets import Button, Input, Static
 
+# Seconds of typing pause before the name is filled in from the path
+AUTOFILL_DELAY = 0.15
+
+
+def _basename(path: str) -> str:
+    return path.rstrip("/").rpartition("/")[2]
+
 
 class AddDirectoryScreen(ModalScreen[tuple[str, str] | None]):
     """Modal to add a directory to IPFS."""
 
     BINDINGS = [("escape", "cancel", "Cancel")]
 
+    def __init__(self) -> None:
+        super().__init__()
+        self._autofill_timer: Timer | None = None
+        self._autofilled = ""
+
     def compose(self) -> ComposeResult:
         with Vertical(classes="modal-dialog"):
             yield Static("Add Directory", id="title")
@@ -27,15 +40,19 @@ class AddDirectoryScreen(ModalScreen[tuple[str, str] | None]):
 
     def on_input_changed(self, event: Input.Changed) -> None:
         if event.input.id == "path-input":
-            path = event.value.strip()
-            name_input = self.query_one("#name-input", Input)
-            if path and not name_input.value:
-                # Auto-fill name from path basename
-                from pathlib import Path
-
-                basename = Path(path).name
-                if basename:
-                    name_input.value = basename
+            # Debounced: only fill in the name once typing pauses
+            if self._autofill_timer is not None:
+                self._autofill_timer.stop()
+            self._autofill_timer = self.set_timer(AUTOFILL_DELAY, self._autofill_name)
+
+    def _autofill_name(self) -> None:
+        """Fill the name from the path basename unless the user typed one."""
+        name_input = self.query_one("#name-input", Input)
+        if name_input.value and name_input.value != self._autofilled:
+            return
+        path = self.query_one("#path-input", Input).value.strip()
+        self._autofilled = _basename(path)
+        name_input.value = self._autofilled
 
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id == "cancel":
@@ -56,7 +73,7 @@ class AddDirectoryScreen(ModalScreen[tuple[str, str] | None]):
             self.notify("Path is required", severity="error")
             return
         if not name:
-            name = path.rstrip("/").split("/")[-1]
+            name = _basename(path)
         self.dismiss((path, name))
 
     def action_cancel(self) -> None:
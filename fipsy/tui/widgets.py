@@ -1,9 +1,22 @@
 """DataTable subclasses for each tab."""
 
+from collections.abc import Iterable
+
 from textual.widgets import DataTable
 
+# A table row as (row key, cells)
+Row = tuple[str, tuple[str, ...]]
+
+
+class _RowTable(DataTable):
+    def populate(self, rows: Iterable[Row]) -> None:
+        """Append keyed rows in one batch, with a single repaint."""
+        with self.app.batch_update():
+            for key, cells in rows:
+                self.add_row(*cells, key=key)
+
 
-class PeerTable(DataTable):
+class PeerTable(_RowTable):
     """Network tab — discovered peers and their content."""
 
     BINDINGS = [
@@ -29,7 +42,7 @@ class PublishedTable(DataTable):
         self.cursor_type = "row"
 
 
-class BrowseTable(DataTable):
+class BrowseTable(_RowTable):
     """Browse tab — all known IPNS keys."""
 
     BINDINGS = [
@@ -1,23 +1,44 @@
 """Business logic for TUI — returns data instead of printing."""
 
-import json
 import shutil
-import subprocess
-import tempfile
+import sqlite3
+import threading
+import time
 from collections.abc import Iterator
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from dataclasses import dataclass, field
+from functools import partial
 from pathlib import Path
+from queue import Empty, SimpleQueue
 
 from fipsy import db, ipfs
-from fipsy.commands import _write_index_html, _write_index_json
+from fipsy.commands import (
+    _IO_POOL,
+    _current_index_state,
+    _fetch_peer_index,
+    _index_hash,
+    _publish_cid,
+    _resolve_key,
+    _write_index_html,
+    _write_index_json,
+)
 
-MAX_WORKERS = 20
 MANY_PEERS_THRESHOLD = 20
 FAST_CAT_TIMEOUT = 2.69
+PIN_CHECK_TIMEOUT = 5
+# Adds hash and read from disk; keep fewer of them in flight than fetches
+MAX_PUBLISH_WORKERS = 8
+WRITE_BATCH_ROWS = 20
+WRITE_FLUSH_INTERVAL = 0.05
 
 
-@dataclass
+@dataclass(slots=True)
 class PeerEntry:
     peer_id: str
     name: str
@@ -25,7 +46,7 @@ class PeerEntry:
     cid: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ScanResult:
     """Result of scanning a single peer."""
 
@@ -33,7 +54,13 @@ class ScanResult:
     entries: list[PeerEntry] = field(default_factory=list)
 
 
-@dataclass
+# What the scan thread reports per peer; an exception aborts the scan
+ScanOutcome = ScanResult | None | Exception
+# A `discovered` table row: (node_id, ipns_name, name)
+DiscoveredRow = tuple[str, str, str | None]
+
+
+@dataclass(slots=True)
 class PublishResult:
     key: str
     ipns_name: str
@@ -41,7 +68,7 @@ class PublishResult:
     error: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class BrowseEntry:
     source: str  # "local" or peer_id
     name: str
@@ -65,57 +92,109 @@ def start_ipfs_daemon() -> bool:
         return False
 
 
-def _resolve_key(ipns_name: str) -> str | None:
-    try:
-        return ipfs.name_resolve(ipns_name)
-    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
-        return None
-
-
-def _fetch_peer_index(peer_id: str, cat_timeout: float) -> ScanResult | None:
-    """Fetch a single peer's index and resolve its IPNS keys."""
-    try:
-        raw = ipfs.cat_path(f"/ipns/{peer_id}/index.json", timeout=cat_timeout)
-        data = json.loads(raw)
-    except (
-        subprocess.CalledProcessError,
-        subprocess.TimeoutExpired,
-        json.JSONDecodeError,
-        OSError,
-    ):
-        return None
-
-    ipns_keys: dict[str, str] = data.get("ipns", {})
-    if not ipns_keys:
-        return None
-
+def _scan_result(
+    peer_id: str, ipns_keys: dict[str, str], resolves: dict[str, Future]
+) -> ScanResult:
     result = ScanResult(peer_id=peer_id)
-    with ThreadPoolExecutor(max_workers=min(10, len(ipns_keys))) as pool:
-        futures = {
-            pool.submit(_resolve_key, key_id): name
-            for name, key_id in ipns_keys.items()
-        }
-        for future in as_completed(futures):
-            name = futures[future]
-            resolved = future.result()
-            cid = resolved.split("/")[-1] if resolved else None
-            result.entries.append(
-                PeerEntry(
-                    peer_id=peer_id,
-                    name=name,
-                    ipns_name=ipns_keys[name],
-                    cid=cid,
-                )
+    for name, key_id in ipns_keys.items():
+        path = resolves[key_id].result()
+        result.entries.append(
+            PeerEntry(
+                peer_id=peer_id,
+                name=name,
+                ipns_name=key_id,
+                cid=path.rpartition("/")[2] if path else None,
             )
-
+        )
     return result
 
 
-def scan_peers_iter() -> Iterator[ScanResult | None | int]:
-    """Scan peers, yielding results as they complete.
+def _write_discovered(writes: SimpleQueue[list[DiscoveredRow] | None]) -> None:
+    """Save discovered rows as they arrive until a None, a few per transaction.
 
-    First yields the total peer count (int), then ScanResult for peers with
-    an index or None for peers without one (to track progress).
+    Rows are flushed once WRITE_BATCH_ROWS have queued up or the oldest has
+    waited WRITE_FLUSH_INTERVAL seconds.
+    """
+    batch: list[DiscoveredRow] = []
+    deadline: float | None = None
+    while True:
+        timeout = None if deadline is None else max(0, deadline - time.monotonic())
+        try:
+            rows = writes.get(timeout=timeout)
+        except Empty:
+            rows = []
+        if rows is None:
+            break
+        if rows and not batch:
+            deadline = time.monotonic() + WRITE_FLUSH_INTERVAL
+        batch += rows
+        if batch and (len(batch) >= WRITE_BATCH_ROWS or time.monotonic() >= deadline):
+            db.upsert_discovered_many(batch)
+            batch, deadline = [], None
+    if batch:
+        db.upsert_discovered_many(batch)
+
+
+def _scan_peers(
+    peers: list[str],
+    cat_timeout: float,
+    out: SimpleQueue[ScanOutcome],
+    writes: SimpleQueue[list[DiscoveredRow] | None],
+) -> None:
+    """Fetch and resolve every peer's index, putting one outcome per peer on `out`.
+
+    Each finished peer's index and key rows are queued on `writes`.
+
+    Index fetches and key resolves share the I/O pool: a fetched index queues
+    its keys' resolves instead of blocking a worker on a pool of its own.
+    Each distinct key is resolved once per scan, even if several peers list it.
+    """
+    index_futures = {
+        _IO_POOL.submit(_fetch_peer_index, pid, cat_timeout): pid for pid in peers
+    }
+    resolves: dict[str, Future] = {}
+    waiting: dict[str, dict[str, str]] = {}
+    pending = set(index_futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future not in index_futures:
+                continue
+            ipns_keys = future.result()
+            if not ipns_keys:
+                out.put(None)
+                continue
+            for key_id in ipns_keys.values():
+                if key_id not in resolves:
+                    resolves[key_id] = _IO_POOL.submit(_resolve_key, key_id)
+                    pending.add(resolves[key_id])
+            waiting[index_futures[future]] = ipns_keys
+
+        for peer_id, ipns_keys in list(waiting.items()):
+            if not all(resolves[k].done() for k in ipns_keys.values()):
+                continue
+            del waiting[peer_id]
+            result = _scan_result(peer_id, ipns_keys, resolves)
+            rows = [(peer_id, peer_id, None)]
+            rows += [(e.peer_id, e.ipns_name, e.name) for e in result.entries]
+            writes.put(rows)
+            out.put(result)
+
+
+def scan_peers_iter(
+    batch_size: int = 1, flush_interval: float | None = None
+) -> Iterator[list[ScanResult | None] | int]:
+    """Scan peers, yielding results in batches as they complete.
+
+    First yields the total peer count (int), then lists holding a ScanResult
+    for each peer with an index or None for each peer without one (to track
+    progress). A batch is yielded once it holds `batch_size` results or its
+    oldest has waited `flush_interval` seconds, whichever comes first.
+
+    The scan runs in its own thread and hands results over through a queue,
+    so a consumer that is slow to pull (e.g. waiting on the UI) never holds
+    up fetching or resolving. Results are saved by a separate writer, so
+    neither side waits on SQLite; the iterator ends once all are saved.
     """
     peers = ipfs.swarm_peers()
     yield len(peers)
@@ -126,22 +205,53 @@ def scan_peers_iter() -> Iterator[ScanResult | None | int]:
     many_peers = len(peers) > MANY_PEERS_THRESHOLD
     cat_timeout = FAST_CAT_TIMEOUT if many_peers else ipfs.DEFAULT_CAT_TIMEOUT
 
-    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(peers))) as pool:
-        futures = {
-            pool.submit(_fetch_peer_index, pid, cat_timeout): pid for pid in peers
-        }
-        for future in as_completed(futures):
-            result = future.result()
-            if result:
-                # Save to DB
-                db.upsert_discovered(result.peer_id, result.peer_id)
-                for entry in result.entries:
-                    db.upsert_discovered(
-                        result.peer_id, entry.ipns_name, name=entry.name
-                    )
-                yield result
-            else:
-                yield None
+    results: SimpleQueue[ScanOutcome] = SimpleQueue()
+    writes: SimpleQueue[list[DiscoveredRow] | None] = SimpleQueue()
+    write_errors: list[Exception] = []
+
+    def write() -> None:
+        try:
+            _write_discovered(writes)
+        except Exception as e:
+            write_errors.append(e)
+
+    # The writer blocks on its queue for the whole scan, so it gets its own
+    # thread rather than a worker of the I/O pool
+    writer = threading.Thread(target=write, name="fipsy-scan-writer", daemon=True)
+    writer.start()
+
+    def run() -> None:
+        try:
+            _scan_peers(peers, cat_timeout, results, writes)
+        except Exception as e:
+            results.put(e)
+        finally:
+            writes.put(None)
+
+    threading.Thread(target=run, name="fipsy-scan", daemon=True).start()
+    remaining = len(peers)
+    batch: list[ScanResult | None] = []
+    deadline: float | None = None
+    while remaining:
+        timeout = None if deadline is None else max(0, deadline - time.monotonic())
+        try:
+            item = results.get(timeout=timeout)
+        except Empty:
+            yield batch
+            batch, deadline = [], None
+            continue
+        if isinstance(item, Exception):
+            raise item
+        remaining -= 1
+        if not batch and flush_interval is not None:
+            deadline = time.monotonic() + flush_interval
+        batch.append(item)
+        if len(batch) >= batch_size or not remaining:
+            yield batch
+            batch, deadline = [], None
+    writer.join()
+    if write_errors:
+        raise write_errors[0]
 
 
 def pin_cid(cid: str) -> bool:
@@ -149,11 +259,11 @@ def pin_cid(cid: str) -> bool:
     try:
         ipfs.pin_add(cid)
         return True
-    except subprocess.CalledProcessError:
+    except ipfs.IpfsError:
         return False
 
 
-def get_published() -> list[dict]:
+def get_published() -> list[sqlite3.Row]:
     """Get all published directories from DB."""
     return db.list_published()
 
@@ -162,15 +272,11 @@ def add_directory(dir_path: str, key_name: str) -> PublishResult:
     """Add a directory to IPFS and publish under an IPNS key."""
     abs_path = Path(dir_path).resolve()
 
-    keys = ipfs.key_list()
-    if key_name not in keys:
-        ipfs.key_gen(key_name)
+    # key_gen returns the new key's ID, so no second key_list is needed
+    ipns_name = ipfs.key_list().get(key_name) or ipfs.key_gen(key_name)
 
     cid = ipfs.add_directory(str(abs_path))
-    ipfs.name_publish(cid, key=key_name, ttl="1m")
-
-    keys = ipfs.key_list()
-    ipns_name = keys.get(key_name, "")
+    _publish_cid(cid, key=key_name)
 
     db.upsert_published(str(abs_path), key_name)
 
@@ -182,6 +288,25 @@ def remove_published(path: str) -> bool:
     return db.delete_published(path)
 
 
+def _publish_one(key: str, path: Path, ipns_name: str | None) -> PublishResult:
+    """Add one directory and publish it under its IPNS key."""
+    if not ipns_name:
+        return PublishResult(key=key, ipns_name="", error="IPNS name not found")
+
+    # add_directory's own scandir of the root reports a missing directory,
+    # so no separate stat is needed
+    try:
+        cid = ipfs.add_directory(str(path))
+        _publish_cid(cid, key=key)
+        return PublishResult(key=key, ipns_name=ipns_name, cid=cid)
+    except FileNotFoundError:
+        return PublishResult(
+            key=key, ipns_name=ipns_name, error=f"Directory not found: {path}"
+        )
+    except ipfs.IpfsError:
+        return PublishResult(key=key, ipns_name=ipns_name, error="Publish failed")
+
+
 def publish_all_iter() -> Iterator[PublishResult | int]:
     """Publish all directories, yielding results as they complete.
 
@@ -194,70 +319,96 @@ def publish_all_iter() -> Iterator[PublishResult | int]:
         return
 
     keys = ipfs.key_list()
-    published_keys: dict[str, str] = {}
-
-    for entry in published:
-        key = entry["key"]
-        path = Path(entry["path"])
-        ipns_name = keys.get(key)
 
-        if not ipns_name:
-            yield PublishResult(key=key, ipns_name="", error="IPNS name not found")
-            continue
-
-        if not path.is_dir():
-            yield PublishResult(
-                key=key, ipns_name=ipns_name, error=f"Directory not found: {path}"
+    with ThreadPoolExecutor(
+        max_workers=min(MAX_PUBLISH_WORKERS, len(published))
+    ) as pool:
+        futures = [
+            pool.submit(
+                _publish_one, entry["key"], Path(entry["path"]), keys.get(entry["key"])
             )
-            continue
+            for entry in published
+        ]
+        for future in as_completed(futures):
+            yield future.result()
 
-        try:
-            cid = ipfs.add_directory(str(path))
-            ipfs.name_publish(cid, key=key, ttl="1m")
-            published_keys[key] = ipns_name
-            yield PublishResult(key=key, ipns_name=ipns_name, cid=cid)
-        except subprocess.CalledProcessError:
-            yield PublishResult(key=key, ipns_name=ipns_name, error="Publish failed")
+    # Built in `published` order, as the CLI does, so the index is stable
+    published_keys: dict[str, str] = {}
+    for future in futures:
+        result = future.result()
+        if result.cid:
+            published_keys[result.key] = result.ipns_name
 
     if not published_keys:
         return
 
+    index_hash = _index_hash(published_keys)
+    if _current_index_state(index_hash):
+        return
+
     # Create and publish discovery index
+    import tempfile
+
     discovery_dir = Path(tempfile.mkdtemp(prefix="fipsy-index-"))
     try:
         _write_index_json(discovery_dir, published_keys)
         _write_index_html(discovery_dir, published_keys)
         cid = ipfs.add_directory(str(discovery_dir))
-        ipfs.name_publish(cid, ttl="1m")
+        _publish_cid(cid)
+        db.set_publish_state(index_hash, cid)
     finally:
         shutil.rmtree(discovery_dir, ignore_errors=True)
 
 
 def get_browse_entries() -> list[BrowseEntry]:
-    """Get all known IPNS keys (local + discovered) for browsing."""
-    entries: list[BrowseEntry] = []
+    """Get all known IPNS keys (local + discovered) for browsing.
+
+    Each IPNS name appears once: local keys take precedence, then the first
+    peer (by node ID) that listed it.
+    """
+    entries: dict[str, BrowseEntry] = {}
+
+    # The daemon queries, the DB read and the pin-check resolves are
+    # independent, so they all run concurrently
+    keys_future = _IO_POOL.submit(ipfs.key_list)
+    pins_future = _IO_POOL.submit(ipfs.pin_ls)
+
+    # One query for both tables; local key IDs come from the daemon
+    rows = db.list_browse_rows()
+    published_paths = {r["name"]: r["source"] for r in rows if r["kind"] == "published"}
+    discovered = [r for r in rows if r["kind"] == "discovered"]
+
+    # Each pin check is an IPNS resolve (cached in the DB)
+    ipns_names = list({row["ipns_name"] for row in discovered})
+    resolve = partial(_resolve_key, timeout=PIN_CHECK_TIMEOUT)
+    paths = dict(zip(ipns_names, _IO_POOL.map(resolve, ipns_names)))
+    keys = keys_future.result()
+    pinned_cids = pins_future.result()
 
     # Local keys
-    keys = ipfs.key_list()
-    published_paths = {e["key"]: e["path"] for e in db.list_published()}
     for key, ipns_name in keys.items():
         display_name = "(index)" if key == "self" else key
-        source = f"local ({published_paths[key]})" if key in published_paths else "local"
-        entries.append(BrowseEntry(source=source, name=display_name, ipns_name=ipns_name))
+        source = (
+            f"local ({published_paths[key]})" if key in published_paths else "local"
+        )
+        entries[ipns_name] = BrowseEntry(
+            source=source, name=display_name, ipns_name=ipns_name
+        )
 
     # Discovered keys
-    discovered = db.list_discovered()
-    pinned_cids = ipfs.pin_ls()
     for row in discovered:
-        name = row["name"] or "(index)"
-        pinned = ipfs.is_pinned(row["ipns_name"], pinned_cids)
-        entries.append(
-            BrowseEntry(
-                source=row["node_id"],
-                name=name,
-                ipns_name=row["ipns_name"],
-                pinned=pinned,
-            )
+        ipns_name = row["ipns_name"]
+        path = paths[ipns_name]
+        pinned = path is not None and path.rpartition("/")[2] in pinned_cids
+        entry = entries.get(ipns_name)
+        if entry is not None:
+            entry.pinned = entry.pinned or pinned
+            continue
+        entries[ipns_name] = BrowseEntry(
+            source=row["source"],
+            name=row["name"] or "(index)",
+            ipns_name=ipns_name,
+            pinned=pinned,
         )
 
-    return entries
+    return list(entries.values())